@@ -11,12 +11,17 @@ from __future__ import (
   with_statement,
 )
 
+import errno
+from functools import partial
+import hashlib
 import os
+import re
 import shutil
 import subprocess
-import tarfile
+import threading
 import uuid
 
+from concurrent.futures import ThreadPoolExecutor
 from pants.base.build_environment import get_buildroot
 from pants.base.exceptions import TaskError
 from pants.base.generator import Generator
@@ -24,6 +29,7 @@ from pants.base.workunit import WorkUnit, WorkUnitLabel
 from pants.task.task import Task
 from pants.util.contextutil import temporary_dir
 from pants.util.dirutil import safe_mkdir
+from pants.util.memo import memoized
 from pkg_resources import resource_string
 
 from fsqio.pants.rpmbuild.targets.rpm_spec import RpmSpecTarget
@@ -39,13 +45,38 @@ DEFAULT_PLATFORMS = {
   },
 }
 
+# Captures the value of every `BuildRequires:` line in a RPM spec.
+BUILD_REQUIRES_RE = re.compile(br'^[ \t]*buildrequires[ \t]*:(.*)$', re.IGNORECASE | re.MULTILINE)
+
+# Operators that separate a package in `BuildRequires:` from its version constraint.
+VERSION_OPERATORS = frozenset([b'<', b'<=', b'=', b'==', b'>=', b'>'])
+
+# Templates for the generated build files, loaded once rather than for every target.
+BUILD_RPM_SH_TEMPLATE = resource_string(__name__, 'build_rpm.sh.mustache')
+DOCKERFILE_BASE_TEMPLATE = resource_string(__name__, 'dockerfile_base.mustache')
+DOCKERFILE_TEMPLATE = resource_string(__name__, 'dockerfile_template.mustache')
+DOCKER_BAKE_TEMPLATE = resource_string(__name__, 'docker_bake.hcl.mustache')
+
+
+@memoized
+def render_entrypoint(spec_basename, shell_before, shell_after):
+  """Render the script run in the build container, which only varies with these parameters."""
+  entrypoint_generator = Generator(
+    BUILD_RPM_SH_TEMPLATE,
+    spec_basename=spec_basename,
+    pre_commands=[{'command': '/bin/bash -i'}] if shell_before else [],
+    post_commands=[{'command': '/bin/bash -i'}] if shell_after else [],
+  )
+  return entrypoint_generator.render()
+
 
 class RpmbuildTask(Task):
   """Build RPM packages for Red Hat-compatible Linux distributions.
 
   This task builds RPM packages (Red Hat Package Manager) given a RPM "spec" file and references
   to the file(s) with which to populate the RPM "SOURCES" directory. The task uses Docker to
-  ensure a consistent build environment for running the `rpmbuild` command.
+  ensure a consistent build environment for running the `rpmbuild` command. The RPMs are built
+  with `docker buildx bake`, so the buildx plugin is required.
   """
 
   @classmethod
@@ -60,7 +91,7 @@ class RpmbuildTask(Task):
     register('--keep-build-products', type=bool, advanced=True,
              help='Do not remove the build directory passed to Docker.')
     register('--docker-build-no-cache', type=bool, advanced=True,
-             help='Do not cache the results of `docker build`.')
+             help='Do not cache the results of `docker buildx bake`.')
     register('--docker-build-context-files', type=list, default=[], advanced=True,
              help='Files to copy into the Docker build context.')
     register('--docker-build-setup-commands', type=list, default=[], advanced=True,
@@ -69,64 +100,227 @@ class RpmbuildTask(Task):
              help='Drop to a shell before invoking `rpmbuild`')
     register('--shell-after', type=bool, advanced=True,
              help='Drop to a shell after invoking `rpmbuild`')
+    register('--max-parallel-builds', type=int, default=8, advanced=True,
+             help='Maximum number of RPM spec targets to build concurrently.')
 
   def __init__(self, *args, **kwargs):
     super(RpmbuildTask, self).__init__(*args, **kwargs)
+    # Digests of local sources, keyed by (path, mtime, size).
+    self._source_digests = {}
+    # Names of the local sources already placed in the shared build context.
+    self._context_sources = set()
 
   @staticmethod
   def is_rpm_spec(target):
     return isinstance(target, RpmSpecTarget)
 
   @staticmethod
-  def write_stream(r, w):
-    size = 1024 * 1024  # 1 MB
-    buf = r.read(size)
-    while buf:
-      w.write(buf)
-      buf = r.read(size)
-
-  def convert_build_req(self, raw_build_reqs):
-    pkg_names = []
-    for raw_build_req in raw_build_reqs.split(','):
-      raw_build_req = raw_build_req.strip()
-      pkg_name = raw_build_req.split(' ')[0]
-      pkg_names.append(pkg_name)
-    return pkg_names
-
-  def extract_build_reqs(self, rpm_spec):
-    build_reqs = []
+  def link_or_copy(src, dst_dir, basename=None):
+    """Place `src` in `dst_dir` as `basename`, hard linking it when possible to avoid a copy.
+
+    Symlinks are not an option since Docker does not follow them out of the build context, so
+    this falls back to a copy when `src` is on another filesystem.
+    """
+    dst = os.path.join(dst_dir, basename or os.path.basename(src))
+    try:
+      # link(2) does not follow symlinks, so link the file that `src` points to.
+      os.link(os.path.realpath(src), dst)
+    except OSError as e:
+      # Never copy over an existing file: it may itself be a hard link to a file in the buildroot.
+      if e.errno == errno.EEXIST:
+        raise TaskError('Multiple files named {} in the build context'.format(os.path.basename(dst)))
+      RpmbuildTask.copy_file(src, dst)
 
+  @staticmethod
+  def copy_file(src, dst):
+    """Copy the contents and mode of `src` to `dst`.
+
+    The copy uses buffers far larger than the 16 KiB `shutil.copy` reads at a time.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+      shutil.copyfileobj(fsrc, fdst, 4 * 1024 * 1024)
+    shutil.copymode(src, dst)
+
+  @staticmethod
+  def write_generated_file(path, content):
+    """Write `content` to `path`, which must not exist yet.
+
+    The build context also holds hard links to files in the buildroot, so writing through an
+    existing file could overwrite the original.
+    """
+    try:
+      fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0644)
+    except OSError as e:
+      if e.errno == errno.EEXIST:
+        raise TaskError('Multiple files named {} in the build context'.format(os.path.basename(path)))
+      raise
+    with os.fdopen(fd, 'wb') as f:
+      f.write(content)
+
+  def source_digest(self, path):
+    """Return a digest of the contents of `path`, only reading it again if it has changed."""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    digest = self._source_digests.get(key)
+    if digest is None:
+      hasher = hashlib.sha256()
+      with open(path, 'rb') as f:
+        for chunk in iter(partial(f.read, 4 * 1024 * 1024), b''):
+          hasher.update(chunk)
+      digest = hasher.hexdigest()[:16]
+      self._source_digests[key] = digest
+    return digest
+
+  def add_context_source(self, path, context_dir):
+    """Place the local source `path` in the shared build context under a content-addressed name.
+
+    Targets sharing a source then share a single copy of it in the build context, and the `COPY`
+    of it refers to the same path in each target's Dockerfile.
+
+    :returns: The path of the source relative to the build context.
+    """
+    context_name = '{}-{}'.format(self.source_digest(path), os.path.basename(path))
+    if context_name not in self._context_sources:
+      self._context_sources.add(context_name)
+      self.link_or_copy(path, os.path.join(context_dir, 'sources'), basename=context_name)
+    return 'sources/{}'.format(context_name)
+
+  @staticmethod
+  def extract_build_reqs(rpm_spec):
     with open(rpm_spec, 'rb') as f:
-      for line in f:
-        line = line.strip().lower()
-        if line.startswith('buildrequires'):
-          raw_build_reqs = line.split(':', 1)[1].strip()
-          build_reqs.extend(self.convert_build_req(raw_build_reqs))
+      spec = f.read()
 
+    # Packages are separated by commas or whitespace, and each may be followed by an operator and
+    # a version, which are dropped.
+    build_reqs = []
+    for raw_build_reqs in BUILD_REQUIRES_RE.findall(spec):
+      tokens = iter(raw_build_reqs.lower().replace(b',', b' ').split())
+      for token in tokens:
+        if token in VERSION_OPERATORS:
+          next(tokens, None)
+        else:
+          build_reqs.append(token.decode('utf-8'))
     return build_reqs
 
   def docker_workunit(self, name, cmd):
+    options = self.get_options()
     return self.context.new_workunit(
       name=name,
       labels=[WorkUnitLabel.RUN],
-      log_config=WorkUnit.LogConfig(level=self.get_options().level, colors=self.get_options().colors),
+      log_config=WorkUnit.LogConfig(level=options.level, colors=options.colors),
       cmd=' '.join(cmd)
     )
 
-  def build_rpm(self, platform, target, build_dir):
-    # Copy the spec file to the build directory.
-    rpm_spec_path = os.path.join(get_buildroot(), target.rpm_spec)
-    shutil.copy(rpm_spec_path, build_dir)
+  @staticmethod
+  def check_call_streamed(cmd, workunit):
+    """Like `subprocess.check_call`, but copies output to `workunit` as soon as it is produced.
+
+    Both pipes are drained by their own thread, so long-running `docker` commands show progress
+    instead of sitting in a pipe buffer, and neither pipe can fill up and stall the command.
+    """
+    def drain(pipe, output):
+      for chunk in iter(partial(os.read, pipe.fileno(), 64 * 1024), b''):
+        output.write(chunk)
+      pipe.close()
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0)
+    drainers = [
+      threading.Thread(target=drain, args=(proc.stdout, workunit.output('stdout'))),
+      threading.Thread(target=drain, args=(proc.stderr, workunit.output('stderr'))),
+    ]
+    for drainer in drainers:
+      drainer.daemon = True
+      drainer.start()
+    for drainer in drainers:
+      drainer.join()
+    retcode = proc.wait()
+    if retcode != 0:
+      raise subprocess.CalledProcessError(retcode, cmd)
+
+  @staticmethod
+  def bake_target_name(target):
+    # Bake target names may only contain alphanumerics, dashes and underscores. Replacing the other
+    # characters can map different ids to the same name, so a hash of the id keeps them apart.
+    return '{}-{}'.format(re.sub(r'[^a-zA-Z0-9_-]', '_', target.id),
+                          hashlib.sha1(target.id.encode('utf-8')).hexdigest()[:8])
+
+  def link_context_files(self, platform, context_dir):
+    """Link the globally-configured files into the shared build context.
+
+    :returns: A fingerprint of the contents of the files, so that builder images are rebuilt when
+      one of them changes.
+    """
+    hasher = hashlib.sha1()
+    for context_file_path_template in self.get_options().docker_build_context_files:
+      context_file_path = context_file_path_template.format(platform_id=platform['id'])
+      self.link_or_copy(context_file_path, context_dir)
+      with open(context_file_path, 'rb') as f:
+        hasher.update(f.read())
+    return hasher.hexdigest()
+
+  def builder_image(self, platform, build_reqs, context_files_fingerprint):
+    """Describe the image holding the platform base and `build_reqs` in which RPMs are built.
+
+    The bake target is named by a hash of its Dockerfile and the context files it may reference, so
+    it is shared by targets with the same build requirements. It is only kept in the BuildKit cache,
+    which the builds read it from through a `target:` context.
+    """
+    # Determine setup commands.
+    setup_commands = [
+      {'command': command.format(platform_id=platform['id'])}
+      for command in self.get_options().docker_build_setup_commands]
+
+    dockerfile_generator = Generator(
+      DOCKERFILE_BASE_TEMPLATE,
+      image=platform['base'],
+      platform_id=platform['id'],
+      setup_commands=setup_commands,
+      build_reqs={'reqs': ' '.join(sorted(set(build_reqs)))} if build_reqs else None,
+    )
+    dockerfile_content = dockerfile_generator.render()
+    hasher = hashlib.sha1()
+    hasher.update(context_files_fingerprint.encode('utf-8'))
+    hasher.update(dockerfile_content.encode('utf-8'))
+    digest = hasher.hexdigest()[:12]
+    return {
+      'name': 'builder-{}'.format(digest),
+      'dockerfile': 'Dockerfile.builder-{}'.format(digest),
+      'dockerfile_content': dockerfile_content,
+      'output': 'type=cacheonly',
+    }
+
+  def image_exists(self, image_name):
+    with open(os.devnull, 'wb') as devnull:
+      return subprocess.call([self.get_options().docker, 'image', 'inspect', image_name],
+                             stdout=devnull, stderr=devnull) == 0
+
+  def write_build_context(self, platform, target, context_dir, context_files_fingerprint):
+    """Write the Dockerfile and sources for `target` into the shared bake build context.
+
+    The spec and entrypoint are placed in a subdirectory named after the bake target so that the
+    files of different targets do not collide, while local sources are shared between targets.
+
+    :returns: A dict describing the bake target for this RPM spec.
+    """
+    options = self.get_options()
+    buildroot = get_buildroot()
+    name = self.bake_target_name(target)
+    build_dir = os.path.join(context_dir, name)
+    safe_mkdir(build_dir)
+
+    # Link the spec file into the build directory.
+    rpm_spec_path = os.path.join(buildroot, target.rpm_spec)
+    self.link_or_copy(rpm_spec_path, build_dir)
     spec_basename = os.path.basename(target.rpm_spec)
 
     # Resolve the build requirements.
     build_reqs = self.extract_build_reqs(rpm_spec_path)
 
-    # Copy local sources to the build directory.
+    # Link local sources into the build context, in a stable order so the Dockerfile is too.
     local_sources = []
-    for source_rel_path in target.sources_relative_to_buildroot():
-      shutil.copy(os.path.join(get_buildroot(), source_rel_path), build_dir)
+    for source_rel_path in sorted(target.sources_relative_to_buildroot(), key=os.path.basename):
       local_sources.append({
+        'context_path': self.add_context_source(os.path.join(buildroot, source_rel_path), context_dir),
         'basename': os.path.basename(source_rel_path),
       })
 
@@ -134,137 +328,261 @@ class RpmbuildTask(Task):
     remote_sources = [{'url': rs, 'basename': os.path.basename(rs)} for rs in target.remote_sources]
 
     # Write the entry point script.
-    entrypoint_generator = Generator(
-      resource_string(__name__, 'build_rpm.sh.mustache'),
-      spec_basename=spec_basename,
-      pre_commands=[{'command': '/bin/bash -i'}] if self.get_options().shell_before else [],
-      post_commands=[{'command': '/bin/bash -i'}] if self.get_options().shell_after else [],
-    )
     entrypoint_path = os.path.join(build_dir, 'build_rpm.sh')
-    with open(entrypoint_path, 'wb') as f:
-      f.write(entrypoint_generator.render())
+    self.write_generated_file(entrypoint_path,
+                              render_entrypoint(spec_basename, options.shell_before, options.shell_after))
     os.chmod(entrypoint_path, 0555)
 
-    # Copy globally-configured files into build directory.
-    for context_file_path_template in self.get_options().docker_build_context_files:
-      context_file_path = context_file_path_template.format(platform_id=platform['id'])
-      shutil.copy(context_file_path, build_dir)
-
-    # Determine setup commands.
-    setup_commands = [
-      {'command': command.format(platform_id=platform['id'])}
-      for command in self.get_options().docker_build_setup_commands]
-
-    # Write the Dockerfile for this build.
+    # Write the Dockerfile for this build, which only adds the sources on top of the builder image.
+    builder = self.builder_image(platform, build_reqs, context_files_fingerprint)
     dockerfile_generator = Generator(
-      resource_string(__name__, 'dockerfile_template.mustache'),
-      image=platform['base'],
-      setup_commands=setup_commands,
+      DOCKERFILE_TEMPLATE,
+      target_dir=name,
       spec_basename=spec_basename,
-      build_reqs={'reqs': ' '.join(build_reqs)} if build_reqs else None,
       local_sources=local_sources,
       remote_sources=remote_sources,
     )
-    dockerfile_path = os.path.join(build_dir, 'Dockerfile')
-    with open(dockerfile_path, 'wb') as f:
-      f.write(dockerfile_generator.render())
-
-    # Generate a UUID to identify the image.
-    image_base_name = 'rpm-image-{}'.format(uuid.uuid4())
-    image_name = '{}:latest'.format(image_base_name)
-    container_name = None
-
-    try:
-      # Build the Docker image that will build the RPMS.
-      build_image_cmd = [
-        self.get_options().docker,
-        'build',
-      ]
-      if self.get_options().docker_build_no_cache:
-        build_image_cmd.append('--no-cache')
-      build_image_cmd.extend([
-        '-t',
-        image_name,
-        build_dir,
-      ])
-      with self.docker_workunit(name='build-image', cmd=build_image_cmd) as workunit:
-        try:
-          self.context.log.debug('Executing: {}'.format(' '.join(build_image_cmd)))
-          subprocess.check_call(build_image_cmd, stdout=workunit.output('stdout'), stderr=workunit.output('stderr'))
-        except subprocess.CalledProcessError as e:
-          raise TaskError('Failed to build image: {0}'.format(e))
-
-      # Run the image in a container to actually build the RPMs.
-      container_name = 'rpm-builder-{}'.format(uuid.uuid4())
-      run_container_cmd = [
-        self.get_options().docker,
-        'run',
-        '--attach=stdout',
-        '--attach=stderr',
-        '--name={}'.format(container_name),
-      ]
-      if self.get_options().shell_before or self.get_options().shell_after:
-        run_container_cmd.extend(['-i', '-t'])
-      run_container_cmd.extend([
-        image_name,
-      ])
-      with self.docker_workunit(name='run-container', cmd=run_container_cmd) as workunit:
-        try:
-          self.context.log.debug('Executing: {}'.format(' '.join(run_container_cmd)))
-          subprocess.check_call(run_container_cmd,
-                                stdout=workunit.output('stdout'),
-                                stderr=workunit.output('stderr'))
-        except subprocess.CalledProcessError as e:
-          raise TaskError('Failed to run build container: {0}'.format(e))
+    dockerfile = 'Dockerfile.{}'.format(name)
+    self.write_generated_file(os.path.join(context_dir, dockerfile), dockerfile_generator.render())
+
+    build = {
+      'name': name,
+      'dockerfile': dockerfile,
+      'builder': builder,
+      # The builder is baked beforehand, so only skip the cache for the stages of this Dockerfile.
+      'no_cache_filter': options.docker_build_no_cache,
+    }
+    if options.shell_before or options.shell_after:
+      # Interactive shells need a container attached to the terminal, so only build the image that
+      # runs `rpmbuild` and run it. Generate UUIDs to identify the image and the container.
+      build.update({
+        'stage': 'builder',
+        'output': 'type=docker',
+        'image_name': 'rpm-image-{}:latest'.format(uuid.uuid4()),
+        'container_name': 'rpm-builder-{}'.format(uuid.uuid4()),
+      })
+    else:
+      # Have BuildKit run `rpmbuild` itself and write out only the resulting RPMs.
+      rpms_dir = os.path.join(build_dir, 'rpms')
+      build.update({
+        'stage': 'rpms',
+        'output': 'type=local,dest={}'.format(rpms_dir),
+        'rpms_dir': rpms_dir,
+      })
+    return build
 
-      # Extract the built RPMs from the container.
-      output_dir = os.path.join(self.get_options().pants_distdir, 'rpmbuild')
-      safe_mkdir(output_dir)
+  @staticmethod
+  def render_bake_file(builds, context_dir):
+    bake_generator = Generator(
+      DOCKER_BAKE_TEMPLATE,
+      context=context_dir,
+      targets=builds,
+    )
+    return bake_generator.render()
+
+  def write_bake_file(self, bake_basename, builds, context_dir):
+    bake_path = os.path.join(context_dir, bake_basename)
+    self.write_generated_file(bake_path, self.render_bake_file(builds, context_dir))
+    return bake_path
+
+  def pull_base_image(self, platform):
+    # Pull the platform base image once up front, rather than having every builder image resolve it
+    # against the registry on its own.
+    if self.image_exists(platform['base']):
+      return
+    pull_cmd = [self.get_options().docker, 'pull', platform['base']]
+    with self.docker_workunit(name='pull-base-image', cmd=pull_cmd) as workunit:
+      try:
+        self.context.log.debug('Executing: {}'.format(' '.join(pull_cmd)))
+        self.check_call_streamed(pull_cmd, workunit)
+      except subprocess.CalledProcessError as e:
+        raise TaskError('Failed to pull base image {0}: {1}'.format(platform['base'], e))
+
+  def bake_images(self, name, bake_path, target_names, no_cache=False):
+    # Build the given bake targets in a single BuildKit invocation, which builds them in parallel.
+    bake_cmd = [
+      self.get_options().docker,
+      'buildx',
+      'bake',
+      '-f',
+      bake_path,
+    ]
+    if no_cache:
+      bake_cmd.append('--no-cache')
+    bake_cmd.extend(target_names)
+    with self.docker_workunit(name=name, cmd=bake_cmd) as workunit:
+      try:
+        self.context.log.debug('Executing: {}'.format(' '.join(bake_cmd)))
+        self.check_call_streamed(bake_cmd, workunit)
+      except subprocess.CalledProcessError as e:
+        raise TaskError('Failed to build images: {0}'.format(e))
+
+  def collect_rpms(self, build, output_dir):
+    """Move the RPMs exported by BuildKit for `build` into `output_dir`.
+
+    The output of `rpmbuild` is exported as a log next to the RPMs, since BuildKit truncates and
+    throttles the output of a build step, and is replayed here in full. A failed build fails the
+    bake instead, with the last MiB of its log in the bake output; the BuildKit limits can be
+    raised with `BUILDKIT_STEP_LOG_MAX_SIZE` and `BUILDKIT_STEP_LOG_MAX_SPEED` on the builder.
+    """
+    rpms_dir = build['rpms_dir']
+    with self.context.new_workunit(name='rpmbuild', labels=[WorkUnitLabel.RUN]) as workunit:
+      with open(os.path.join(rpms_dir, 'rpmbuild.log'), 'rb') as f:
+        shutil.copyfileobj(f, workunit.output('stdout'))
+
+    for root, _, filenames in os.walk(rpms_dir):
+      for filename in filenames:
+        if filename.endswith('.rpm'):
+          rpm_path = os.path.join(root, filename)
+          rel_rpm_path = os.path.relpath(rpm_path, rpms_dir)
+          self.context.log.info('Extracting {}'.format(rel_rpm_path))
+          safe_mkdir(os.path.join(output_dir, os.path.dirname(rel_rpm_path)))
+          shutil.move(rpm_path, os.path.join(output_dir, rel_rpm_path))
+
+  def build_rpm(self, build, output_dir):
+    # Run the image in a container attached to the terminal so that the shells around `rpmbuild`
+    # are interactive.
+    options = self.get_options()
+    container_name = build['container_name']
+    run_container_cmd = [
+      options.docker,
+      'run',
+      '--attach=stdout',
+      '--attach=stderr',
+      '--name={}'.format(container_name),
+      '-i',
+      '-t',
+      build['image_name'],
+    ]
+    build['container_created'] = True
+    with self.docker_workunit(name='run-container', cmd=run_container_cmd) as workunit:
+      try:
+        self.context.log.debug('Executing: {}'.format(' '.join(run_container_cmd)))
+        self.check_call_streamed(run_container_cmd, workunit)
+      except subprocess.CalledProcessError as e:
+        raise TaskError('Failed to run build container: {0}'.format(e))
+
+    # Extract the built RPMs from the container.
+    for rpms_dir in ('RPMS', 'SRPMS'):
       extract_rpms_cmd = [
-        self.get_options().docker,
-        'export',
-        container_name,
+        options.docker,
+        'cp',
+        '{}:/home/rpmuser/rpmbuild/{}'.format(container_name, rpms_dir),
+        output_dir,
       ]
+      self.context.log.info('Extracting {} for {}'.format(rpms_dir, build['name']))
       with self.docker_workunit(name='extract-rpms', cmd=extract_rpms_cmd) as workunit:
-        proc = subprocess.Popen(extract_rpms_cmd, stdout=subprocess.PIPE, stderr=None)
-        with tarfile.open(fileobj=proc.stdout, mode='r|*') as tar:
-          for entry in tar:
-            name = entry.name
-            if (name.startswith('home/rpmuser/rpmbuild/RPMS/') or name.startswith('home/rpmuser/rpmbuild/SRPMS/')) and name.endswith('.rpm'):
-              rel_rpm_path = name.lstrip('home/rpmuser/rpmbuild/')
-              if rel_rpm_path:
-                self.context.log.info('Extracting {}'.format(rel_rpm_path))
-                fileobj = tar.extractfile(entry)
-                safe_mkdir(os.path.join(output_dir, os.path.dirname(rel_rpm_path)))
-                with open(os.path.join(output_dir, rel_rpm_path), 'wb') as f:
-                  self.write_stream(fileobj, f)
-
-        retcode = proc.wait()
-        if retcode != 0:
-          raise TaskError('Failed to extract RPMS')
-
-    finally:
-      # Remove the build container.
-      if container_name and not self.get_options().keep_build_products:
-        remove_container_cmd = [self.get_options().docker, 'rm', container_name]
-        with self.docker_workunit(name='remove-build-container', cmd=remove_container_cmd) as workunit:
-          subprocess.call(remove_container_cmd, stdout=workunit.output('stdout'), stderr=workunit.output('stderr'))
-
-      # Remove the build image.
-      if not self.get_options().keep_build_products:
-        remove_image_cmd = [self.get_options().docker, 'rmi', image_name]
-        with self.docker_workunit(name='remove-build-image', cmd=remove_image_cmd) as workunit:
-          subprocess.call(remove_image_cmd, stdout=workunit.output('stdout'), stderr=workunit.output('stderr'))
+        try:
+          self.context.log.debug('Executing: {}'.format(' '.join(extract_rpms_cmd)))
+          self.check_call_streamed(extract_rpms_cmd, workunit)
+        except subprocess.CalledProcessError as e:
+          raise TaskError('Failed to extract {0}: {1}'.format(rpms_dir, e))
+
+  def remove_build_products(self, builds):
+    # Remove the build containers and images of all targets with one command each.
+    docker = self.get_options().docker
+    container_names = [build['container_name'] for build in builds if build.get('container_created')]
+    if container_names:
+      remove_containers_cmd = [docker, 'rm', '-f'] + container_names
+      with self.docker_workunit(name='remove-build-containers', cmd=remove_containers_cmd) as workunit:
+        subprocess.call(remove_containers_cmd, stdout=workunit.output('stdout'), stderr=workunit.output('stderr'))
+    image_names = [build['image_name'] for build in builds if build.get('image_name')]
+    if image_names:
+      remove_images_cmd = [docker, 'rmi'] + image_names
+      with self.docker_workunit(name='remove-build-images', cmd=remove_images_cmd) as workunit:
+        subprocess.call(remove_images_cmd, stdout=workunit.output('stdout'), stderr=workunit.output('stderr'))
 
   def execute(self):
-    platform_key = self.get_options().platform
-    try:
-      platform = self.get_options().platforms[platform_key]
-      platform['id'] = platform_key
-    except KeyError:
+    options = self.get_options()
+    platform_key = options.platform
+    platforms = options.platforms
+    if platform_key not in platforms:
       raise TaskError('Unknown platform {}'.format(platform_key))
-
-    for target in self.context.targets(self.is_rpm_spec):
-      with temporary_dir(cleanup=not self.get_options().keep_build_products) as build_dir:
-        self.context.log.debug('Build directory: {}'.format(build_dir))
-        self.build_rpm(platform, target, build_dir)
+    # Copy the platform rather than annotating the option value that other tasks may also see.
+    platform = dict(platforms[platform_key])
+    platform['id'] = platform_key
+
+    targets = self.context.targets(self.is_rpm_spec)
+    if not targets:
+      return
+
+    # Each target gets its own build directory and Dockerfile named after its bake target.
+    names = {}
+    for target in targets:
+      name = self.bake_target_name(target)
+      if name in names:
+        raise TaskError('Targets {} and {} map to the same bake target name {}'.format(
+          names[name].address.spec, target.address.spec, name))
+      names[name] = target
+
+    max_parallel_builds = max(1, options.max_parallel_builds)
+
+    with self.context.new_workunit(name='build-rpms', labels=[WorkUnitLabel.MULTITOOL]) as workunit:
+      # Keep the build context under the workdir, which is on the same filesystem as the buildroot,
+      # so that sources are hard linked into it rather than copied.
+      safe_mkdir(self.workdir)
+      with temporary_dir(root_dir=self.workdir,
+                         cleanup=not options.keep_build_products) as context_dir:
+        self.context.log.debug('Build context directory: {}'.format(context_dir))
+        executor = ThreadPoolExecutor(max_workers=min(max_parallel_builds, len(targets)))
+        builds = []
+        try:
+          safe_mkdir(os.path.join(context_dir, 'sources'))
+          context_files_fingerprint = self.link_context_files(platform, context_dir)
+          builds = [
+            self.write_build_context(platform, target, context_dir, context_files_fingerprint)
+            for target in targets
+          ]
+
+          # The builder images are bake targets of their own that the builds reference through a
+          # `target:` context, so BuildKit resolves them itself with any buildx driver rather than
+          # through the local image store. Each one is only built once, however many targets use it.
+          builders = {}
+          for build in builds:
+            builders[build['builder']['name']] = build['builder']
+          builders = [builder for _, builder in sorted(builders.items())]
+          for builder in builders:
+            self.write_generated_file(os.path.join(context_dir, builder['dockerfile']),
+                                      builder['dockerfile_content'])
+
+          self.pull_base_image(platform)
+          bake_path = self.write_bake_file('docker-bake.hcl', builders + builds, context_dir)
+
+          # Bake all the builders up front, so that each `yum install` runs once. Then bake every
+          # target on its own, up to `--max-parallel-builds` at once, taking its builder from the
+          # cache, so that a slow target only holds up its own slot.
+          builder_names = [builder['name'] for builder in builders]
+          self.bake_images('build-builder-images', bake_path, builder_names,
+                           no_cache=options.docker_build_no_cache)
+
+          def bake_build(build):
+            self.bake_images('build-image', bake_path, [build['name']])
+          self.map_in_executor(executor, workunit, bake_build, builds)
+
+          output_dir = os.path.join(options.pants_distdir, 'rpmbuild')
+          safe_mkdir(output_dir)
+          if options.shell_before or options.shell_after:
+            # Interactive shells need the terminal to themselves, so run one container at a time.
+            for build in builds:
+              self.build_rpm(build, output_dir)
+          else:
+            for build in builds:
+              self.collect_rpms(build, output_dir)
+        finally:
+          executor.shutdown(wait=True)
+          if not options.keep_build_products:
+            self.remove_build_products(builds)
+
+  def map_in_executor(self, executor, parent_workunit, fn, items):
+    """Apply `fn` to each of `items` on `executor`, returning the results in order.
+
+    The first failure is re-raised once it is reached; the remaining calls are still allowed to
+    finish so that no bake is still reading the build context when it is cleaned up.
+    """
+    def run_in_workunit(item):
+      # Workunits created on this thread must be attached to the parent workunit of the execute.
+      self.context.run_tracker.register_thread(parent_workunit)
+      return fn(item)
+
+    futures = [executor.submit(run_in_workunit, item) for item in items]
+    return [future.result() for future in futures]
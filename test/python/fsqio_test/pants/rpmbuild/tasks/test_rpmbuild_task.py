@@ -0,0 +1,199 @@
+# coding=utf-8
+# Copyright 2016 Foursquare Labs Inc. All Rights Reserved.
+
+from __future__ import (
+  absolute_import,
+  division,
+  generators,
+  nested_scopes,
+  print_function,
+  unicode_literals,
+  with_statement,
+)
+
+import errno
+import os
+import stat
+import unittest
+
+from pants.base.exceptions import TaskError
+from pants.build_graph.address import Address
+from pants.util.contextutil import temporary_dir
+
+from fsqio.pants.rpmbuild.tasks.rpmbuild_task import RpmbuildTask
+
+
+class FakeTarget(object):
+
+  def __init__(self, spec):
+    self.id = Address.parse(spec).path_safe_spec
+
+
+class TestRpmbuildTask(unittest.TestCase):
+  # NOTE: These only cover the helpers that do not need a Pants context or Docker.
+
+  def _extract_build_reqs(self, spec):
+    with temporary_dir() as tmpdir:
+      spec_path = os.path.join(tmpdir, 'test.spec')
+      with open(spec_path, 'wb') as f:
+        f.write(spec)
+      return RpmbuildTask.extract_build_reqs(spec_path)
+
+  def test_extract_build_reqs(self):
+    spec = b'Name: test\nBuildRequires: gcc, make >= 3.8\nbuildrequires:Python-Devel\n'
+    self.assertEqual(self._extract_build_reqs(spec), ['gcc', 'make', 'python-devel'])
+
+  def test_extract_build_reqs_ignores_lines_without_colon(self):
+    spec = b'BuildRequires gcc\n%description\nBuildRequires are installed in the builder image.\n'
+    self.assertEqual(self._extract_build_reqs(spec), [])
+
+  def test_extract_build_reqs_skips_empty_entries(self):
+    spec = b'BuildRequires: gcc,, make,\nBuildRequires:\nBuildRequires: ,\n'
+    self.assertEqual(self._extract_build_reqs(spec), ['gcc', 'make'])
+
+  def test_extract_build_reqs_splits_on_whitespace(self):
+    spec = b'BuildRequires:\tfoo\tbar\nBuildRequires: baz >= 1.0 qux\n'
+    self.assertEqual(self._extract_build_reqs(spec), ['foo', 'bar', 'baz', 'qux'])
+
+  def test_link_or_copy(self):
+    with temporary_dir() as src_dir, temporary_dir() as dst_dir:
+      src = os.path.join(src_dir, 'source.tar.gz')
+      with open(src, 'wb') as f:
+        f.write(b'source')
+      RpmbuildTask.link_or_copy(src, dst_dir)
+      with open(os.path.join(dst_dir, 'source.tar.gz'), 'rb') as f:
+        self.assertEqual(f.read(), b'source')
+
+  def test_link_or_copy_falls_back_to_copy(self):
+    def link_across_devices(src, dst):
+      raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+    with temporary_dir() as src_dir, temporary_dir() as dst_dir:
+      src = os.path.join(src_dir, 'source.tar.gz')
+      with open(src, 'wb') as f:
+        f.write(b'source')
+      os.chmod(src, 0750)
+      link = os.link
+      os.link = link_across_devices
+      try:
+        RpmbuildTask.link_or_copy(src, dst_dir)
+      finally:
+        os.link = link
+      dst = os.path.join(dst_dir, 'source.tar.gz')
+      self.assertNotEqual(os.stat(src).st_ino, os.stat(dst).st_ino)
+      self.assertEqual(stat.S_IMODE(os.stat(dst).st_mode), 0750)
+      with open(dst, 'rb') as f:
+        self.assertEqual(f.read(), b'source')
+
+  def test_link_or_copy_follows_symlinks(self):
+    with temporary_dir() as src_dir, temporary_dir() as dst_dir:
+      with open(os.path.join(src_dir, 'real.tar.gz'), 'wb') as f:
+        f.write(b'source')
+      src = os.path.join(src_dir, 'source.tar.gz')
+      os.symlink('real.tar.gz', src)
+      RpmbuildTask.link_or_copy(src, dst_dir)
+      dst = os.path.join(dst_dir, 'source.tar.gz')
+      self.assertFalse(os.path.islink(dst))
+      with open(dst, 'rb') as f:
+        self.assertEqual(f.read(), b'source')
+
+  def test_link_or_copy_refuses_existing_file(self):
+    # The existing file may be a hard link into the buildroot, so it must be left untouched.
+    with temporary_dir() as src_dir, temporary_dir() as dst_dir:
+      src = os.path.join(src_dir, 'source.tar.gz')
+      with open(src, 'wb') as f:
+        f.write(b'source')
+      dst = os.path.join(dst_dir, 'source.tar.gz')
+      with open(dst, 'wb') as f:
+        f.write(b'existing')
+      with self.assertRaises(TaskError):
+        RpmbuildTask.link_or_copy(src, dst_dir)
+      with open(dst, 'rb') as f:
+        self.assertEqual(f.read(), b'existing')
+
+  def test_write_generated_file_refuses_existing_file(self):
+    with temporary_dir() as tmpdir:
+      path = os.path.join(tmpdir, 'Dockerfile')
+      RpmbuildTask.write_generated_file(path, 'FROM scratch\n')
+      with self.assertRaises(TaskError):
+        RpmbuildTask.write_generated_file(path, 'FROM centos:7\n')
+      with open(path, 'rb') as f:
+        self.assertEqual(f.read(), b'FROM scratch\n')
+
+  def test_bake_target_name(self):
+    name = RpmbuildTask.bake_target_name(FakeTarget('foo/bar:spec'))
+    self.assertRegexpMatches(name, r'^[a-zA-Z0-9_-]+$')
+
+  def test_bake_target_name_is_unique(self):
+    # Both ids sanitize to the same characters, so only the hash keeps the names apart.
+    self.assertNotEqual(RpmbuildTask.bake_target_name(FakeTarget('foo_bar/baz:spec')),
+                        RpmbuildTask.bake_target_name(FakeTarget('foo/bar_baz:spec')))
+
+  def test_render_bake_file(self):
+    builder = {
+      'name': 'builder-0123',
+      'dockerfile': 'Dockerfile.builder-0123',
+      'output': 'type=cacheonly',
+    }
+    build = {
+      'name': 'foo-4567',
+      'dockerfile': 'Dockerfile.foo-4567',
+      'builder': builder,
+      'no_cache_filter': False,
+      'stage': 'rpms',
+      'output': 'type=local,dest=/ctx/foo-4567/rpms',
+    }
+    interactive_build = {
+      'name': 'bar-89ab',
+      'dockerfile': 'Dockerfile.bar-89ab',
+      'builder': builder,
+      'no_cache_filter': True,
+      'stage': 'builder',
+      'output': 'type=docker',
+      'image_name': 'rpm-image-1:latest',
+    }
+    bake_file = RpmbuildTask.render_bake_file([builder, build, interactive_build], '/ctx')
+
+    self.assertIn(
+      'group "default" {\n'
+      '  targets = [\n'
+      '    "builder-0123",\n'
+      '    "foo-4567",\n'
+      '    "bar-89ab",\n'
+      '  ]\n'
+      '}\n',
+      bake_file)
+    self.assertIn(
+      'target "builder-0123" {\n'
+      '  context = "/ctx"\n'
+      '  dockerfile = "Dockerfile.builder-0123"\n'
+      '  output = ["type=cacheonly"]\n'
+      '}\n',
+      bake_file)
+    self.assertIn(
+      'target "foo-4567" {\n'
+      '  context = "/ctx"\n'
+      '  dockerfile = "Dockerfile.foo-4567"\n'
+      '  target = "rpms"\n'
+      '  contexts = {\n'
+      '    rpm-builder = "target:builder-0123"\n'
+      '  }\n'
+      '  output = ["type=local,dest=/ctx/foo-4567/rpms"]\n'
+      '}\n',
+      bake_file)
+    self.assertIn(
+      'target "bar-89ab" {\n'
+      '  context = "/ctx"\n'
+      '  dockerfile = "Dockerfile.bar-89ab"\n'
+      '  target = "builder"\n'
+      '  no-cache-filter = ["builder", "build", "rpms"]\n'
+      '  contexts = {\n'
+      '    rpm-builder = "target:builder-0123"\n'
+      '  }\n'
+      '  tags = ["rpm-image-1:latest"]\n'
+      '  args = {\n'
+      '    BUILDKIT_INLINE_CACHE = "1"\n'
+      '  }\n'
+      '  output = ["type=docker"]\n'
+      '}\n',
+      bake_file)